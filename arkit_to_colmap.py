@@ -10,18 +10,21 @@ import argparse
 import json
 import os
 import shutil
+import struct
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
 
 import numpy as np
+import orjson
 from PIL import Image
-from scipy.spatial.transform import Rotation
 from tqdm import tqdm
 
 
 def parse_arkit_json(json_path: Path) -> dict:
     """Parse 3D Scanner app JSON export."""
-    with open(json_path) as f:
-        data = json.load(f)
+    with open(json_path, 'rb') as f:
+        data = orjson.loads(f.read())
     
     # Parse 4x4 camera-to-world matrix
     # ARKit stores as flat 16-element array in ROW-MAJOR order
@@ -44,50 +47,92 @@ def parse_arkit_json(json_path: Path) -> dict:
     }
 
 
-def arkit_to_colmap_pose(c2w_arkit: np.ndarray) -> tuple:
+def rotation_matrices_to_quats(R: np.ndarray) -> np.ndarray:
     """
-    Convert ARKit camera-to-world to COLMAP world-to-camera.
+    Convert (N, 3, 3) rotation matrices to (N, 4) quaternions [qw, qx, qy, qz].
+    
+    Shoemake's method: build the quaternion from whichever of the trace or a
+    diagonal entry is largest, so the normalization never divides by ~0.
+    """
+    R00, R01, R02 = R[:, 0, 0], R[:, 0, 1], R[:, 0, 2]
+    R10, R11, R12 = R[:, 1, 0], R[:, 1, 1], R[:, 1, 2]
+    R20, R21, R22 = R[:, 2, 0], R[:, 2, 1], R[:, 2, 2]
+    tr = R00 + R11 + R22
+    
+    # Unnormalized candidates for each case, shape (4 cases, N, 4 components)
+    # (ties resolve in the same order as scipy's Rotation.from_matrix)
+    candidates = np.stack([
+        np.stack([R21 - R12, 1 + R00 - R11 - R22, R01 + R10, R02 + R20], axis=-1),
+        np.stack([R02 - R20, R01 + R10, 1 - R00 + R11 - R22, R12 + R21], axis=-1),
+        np.stack([R10 - R01, R02 + R20, R12 + R21, 1 - R00 - R11 + R22], axis=-1),
+        np.stack([1 + tr, R21 - R12, R02 - R20, R10 - R01], axis=-1),
+    ])
+    choice = np.argmax(np.stack([R00, R11, R22, tr]), axis=0)
+    q = candidates[choice, np.arange(len(R))]
+    
+    return q / np.linalg.norm(q, axis=-1, keepdims=True)
+
+
+def arkit_batch_to_colmap_poses(poses: np.ndarray) -> tuple:
+    """
+    Convert a stack of ARKit camera-to-world poses to COLMAP world-to-camera.
     
     ARKit: Y-up, -Z forward, right-handed
     COLMAP: Y-down, Z forward, right-handed
     
-    Returns: (qw, qx, qy, qz, tx, ty, tz)
+    Args:
+        poses: (N, 4, 4) array of ARKit camera-to-world matrices
+    
+    Returns: (quats, trans) with quats (N, 4) as [qw, qx, qy, qz] and trans (N, 3)
     """
     # Coordinate system conversion: flip Y and Z axes
-    flip = np.diag([1.0, -1.0, -1.0, 1.0])
-    c2w_colmap = flip @ c2w_arkit @ flip
+    # Equivalent to diag(1, -1, -1, 1) @ M @ diag(1, -1, -1, 1), applied
+    # directly to the rotation block and translation (bottom row is unused)
+    R_c2w = poses[:, :3, :3].copy()
+    R_c2w[:, 1:3, 0] *= -1
+    R_c2w[:, 0, 1:3] *= -1
+    t_c2w = poses[:, :3, 3].copy()
+    t_c2w[:, 1:3] *= -1
     
     # Invert to get world-to-camera (what COLMAP stores)
-    w2c = np.linalg.inv(c2w_colmap)
-    
-    # Extract rotation and translation
-    R = w2c[:3, :3]
-    t = w2c[:3, 3]
+    # Rigid transform, so the inverse is [R^T | -R^T t]
+    R = np.transpose(R_c2w, (0, 2, 1))
+    t = -np.einsum('nij,nj->ni', R, t_c2w)
     
-    # Convert rotation to quaternion using scipy
-    # scipy returns [qx, qy, qz, qw], COLMAP wants [qw, qx, qy, qz]
-    quat = Rotation.from_matrix(R).as_quat()
-    qw, qx, qy, qz = quat[3], quat[0], quat[1], quat[2]
+    # Convert rotations to quaternions (COLMAP order [qw, qx, qy, qz])
+    quats = rotation_matrices_to_quats(R)
     
-    return qw, qx, qy, qz, t[0], t[1], t[2]
+    # The sign flips turn exact zeros into -0.0; adding 0.0 maps them back
+    return quats + 0.0, t + 0.0
 
 
-def find_matching_image(json_path: Path, scan_dir: Path) -> Path | None:
-    """Find the JPG image matching a JSON metadata file."""
-    # Try same name with .jpg extension
+def find_matching_image(json_path: Path, image_index: dict, pad: int | None = None) -> Path | None:
+    """
+    Find the JPG image matching a JSON metadata file.
+    
+    The exact JSON stem is tried first. If the scan's image number padding
+    is known (see detect_image_padding), the padded name is the only other
+    lookup; otherwise several paddings are tried.
+    """
     frame_num = json_path.stem.replace('frame_', '')
     
     # Try frame_XXXXX.jpg
-    jpg_path = scan_dir / f"frame_{frame_num}.jpg"
-    if jpg_path.exists():
+    jpg_path = image_index.get(json_path.stem)
+    if jpg_path is not None:
         return jpg_path
     
+    if pad is not None:
+        try:
+            return image_index.get(f"frame_{int(frame_num):0{pad}d}")
+        except ValueError:
+            return None
+    
     # Try with different padding
     try:
         idx = int(frame_num)
-        for fmt in ['frame_{:05d}.jpg', 'frame_{:04d}.jpg', 'frame_{:03d}.jpg']:
-            jpg_path = scan_dir / fmt.format(idx)
-            if jpg_path.exists():
+        for fmt in ['frame_{:05d}', 'frame_{:04d}', 'frame_{:03d}']:
+            jpg_path = image_index.get(fmt.format(idx))
+            if jpg_path is not None:
                 return jpg_path
     except ValueError:
         pass
@@ -95,46 +140,193 @@ def find_matching_image(json_path: Path, scan_dir: Path) -> Path | None:
     return None
 
 
+def build_image_index(scan_dir: Path) -> dict:
+    """Map image stem to path for every JPG in scan_dir (one directory scan)."""
+    return {
+        entry.name.rsplit('.', 1)[0]: scan_dir / entry.name
+        for entry in os.scandir(scan_dir)
+        if entry.name.endswith('.jpg')
+    }
+
+
+def detect_image_padding(image_index: dict) -> int | None:
+    """
+    Return the zero-padded width of frame numbers in the scan's image names.
+    
+    Returns None unless every frame_<digits> name has the same digit count,
+    since unpadded or mixed-width names cannot be resolved by one format.
+    """
+    widths = {
+        len(stem) - len('frame_')
+        for stem in image_index
+        if stem.startswith('frame_') and stem[len('frame_'):].isdigit()
+    }
+    return widths.pop() if len(widths) == 1 else None
+
+
+# Below this many frames, metadata is parsed in-process rather than in a pool
+PARALLEL_PARSE_MIN_FRAMES = 256
+
+# Per-worker image lookup state, set once by _init_parse_worker
+_worker_image_index: dict = {}
+_worker_pad: int | None = None
+
+
+def _init_parse_worker(image_index: dict, pad: int | None):
+    """Store the scan's image index in the worker so it is sent only once."""
+    global _worker_image_index, _worker_pad
+    _worker_image_index = image_index
+    _worker_pad = pad
+
+
+def _parse_one(
+    json_path: Path,
+    quality_threshold: float,
+    image_index: dict | None = None,
+    pad: int | None = None,
+) -> tuple:
+    """
+    Parse and filter a single frame.
+    
+    Inside the parse pool the image index comes from _init_parse_worker;
+    callers outside it pass image_index (and pad) directly. If neither is
+    available the index is built from the JSON file's directory.
+    
+    Returns: (frame or None, skip_reason or None)
+    """
+    if image_index is None:
+        image_index, pad = _worker_image_index, _worker_pad
+        if not image_index:
+            image_index = build_image_index(json_path.parent)
+            pad = detect_image_padding(image_index)
+    
+    try:
+        frame = parse_arkit_json(json_path)
+    except (json.JSONDecodeError, orjson.JSONDecodeError, KeyError) as e:
+        print(f"  Warning: Could not parse {json_path}: {e}")
+        return None, 'parse_error'
+    
+    # Filter by quality
+    if frame['motion_quality'] < quality_threshold:
+        return None, 'quality'
+    
+    # Find matching image
+    image_path = find_matching_image(json_path, image_index, pad)
+    if image_path is None:
+        return None, 'no_image'
+    
+    frame['image_path'] = image_path
+    frame['image_name'] = image_path.name
+    return frame, None
+
+
+def _link_image(frame: dict, images_dir: Path, link_mode: str):
+    """Place a frame's image into images_dir by copying or symlinking it."""
+    dst = os.path.join(images_dir, frame['image_name'])
+    if link_mode == 'symlink':
+        os.symlink(Path(frame['image_path']).resolve(), dst)
+    else:
+        # copyfile uses os.sendfile / fcopyfile where available
+        shutil.copyfile(frame['image_path'], dst)
+
+
+# SOFn markers carry the frame size; C4 (DHT), C8 (JPG) and CC (DAC) do not
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def jpeg_size(path: Path) -> tuple:
+    """
+    Read (width, height) from a JPEG's SOFn marker without decoding it.
+    
+    Falls back to PIL if the marker cannot be found.
+    """
+    with open(path, 'rb') as f:
+        if f.read(2) == b'\xff\xd8':
+            while True:
+                byte = f.read(1)
+                if not byte:
+                    break
+                if byte != b'\xff':
+                    continue
+                marker = f.read(1)
+                while marker == b'\xff':  # Fill bytes
+                    marker = f.read(1)
+                if not marker:
+                    break
+                marker = marker[0]
+                if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+                    continue  # Standalone markers have no length field
+                segment = f.read(2)
+                if len(segment) < 2:
+                    break
+                (length,) = struct.unpack('>H', segment)
+                if marker in _JPEG_SOF_MARKERS:
+                    frame_header = f.read(5)
+                    if len(frame_header) < 5:
+                        break
+                    _, height, width = struct.unpack('>BHH', frame_header)
+                    return width, height
+                f.seek(length - 2, os.SEEK_CUR)
+    
+    with Image.open(path) as img:
+        return img.size
+
+
 def write_colmap_model(frames: list, output_dir: Path, image_width: int, image_height: int):
     """Write COLMAP sparse model files in text format."""
     sparse_dir = output_dir / 'sparse' / '0'
     sparse_dir.mkdir(parents=True, exist_ok=True)
     
     # Get average intrinsics (should be same for all frames from same device)
-    fx = np.mean([f['fx'] for f in frames])
-    fy = np.mean([f['fy'] for f in frames])
-    cx = np.mean([f['cx'] for f in frames])
-    cy = np.mean([f['cy'] for f in frames])
+    intrinsics = np.array([(f['fx'], f['fy'], f['cx'], f['cy']) for f in frames])
+    fx, fy, cx, cy = intrinsics.mean(axis=0)
     
     # cameras.txt - Single shared camera (PINHOLE model)
     cameras_path = sparse_dir / 'cameras.txt'
-    with open(cameras_path, 'w') as f:
-        f.write("# Camera list with one line of data per camera:\n")
-        f.write("# CAMERA_ID, MODEL, WIDTH, HEIGHT, PARAMS[]\n")
-        f.write(f"1 PINHOLE {image_width} {image_height} {fx:.6f} {fy:.6f} {cx:.6f} {cy:.6f}\n")
+    cameras_path.write_text(
+        "# Camera list with one line of data per camera:\n"
+        "# CAMERA_ID, MODEL, WIDTH, HEIGHT, PARAMS[]\n"
+        f"1 PINHOLE {image_width} {image_height} {fx:.6f} {fy:.6f} {cx:.6f} {cy:.6f}\n"
+    )
     
     # images.txt - Two lines per image
     images_path = sparse_dir / 'images.txt'
     with open(images_path, 'w') as f:
-        f.write("# Image list with two lines of data per image:\n")
-        f.write("# IMAGE_ID, QW, QX, QY, QZ, TX, TY, TZ, CAMERA_ID, NAME\n")
-        f.write("# POINTS2D[] as (X, Y, POINT3D_ID)\n")
+        f.write(
+            "# Image list with two lines of data per image:\n"
+            "# IMAGE_ID, QW, QX, QY, QZ, TX, TY, TZ, CAMERA_ID, NAME\n"
+            "# POINTS2D[] as (X, Y, POINT3D_ID)\n"
+        )
         
-        for i, frame in enumerate(frames, 1):
-            qw, qx, qy, qz, tx, ty, tz = arkit_to_colmap_pose(frame['pose'])
-            filename = frame['image_name']
-            f.write(f"{i} {qw:.10f} {qx:.10f} {qy:.10f} {qz:.10f} {tx:.10f} {ty:.10f} {tz:.10f} 1 {filename}\n")
-            f.write("\n")  # Empty line for 2D points (populated by COLMAP)
+        poses = np.stack([frame['pose'] for frame in frames])
+        quats, trans = arkit_batch_to_colmap_poses(poses)
+        
+        # Pose line followed by an empty line for 2D points (populated by COLMAP)
+        line_fmt = "{} {:.10f} {:.10f} {:.10f} {:.10f} {:.10f} {:.10f} {:.10f} 1 {}\n\n"
+        pose_rows = np.concatenate([quats, trans], axis=1).tolist()
+        f.writelines([
+            line_fmt.format(i, *row, frame['image_name'])
+            for i, (row, frame) in enumerate(zip(pose_rows, frames), 1)
+        ])
     
     # points3D.txt - Initially empty
     points_path = sparse_dir / 'points3D.txt'
-    with open(points_path, 'w') as f:
-        f.write("# 3D point list with one line of data per point:\n")
-        f.write("# POINT3D_ID, X, Y, Z, R, G, B, ERROR, TRACK[] as (IMAGE_ID, POINT2D_IDX)\n")
+    points_path.write_text(
+        "# 3D point list with one line of data per point:\n"
+        "# POINT3D_ID, X, Y, Z, R, G, B, ERROR, TRACK[] as (IMAGE_ID, POINT2D_IDX)\n"
+    )
+    
+    # image_list.txt - Kept frames only, so COLMAP can skip filtered images
+    # when reading straight from the scan folder (--link-mode none)
+    image_list_path = output_dir / 'image_list.txt'
+    image_list_path.write_text(
+        "".join(f"{name}\n" for name in dict.fromkeys(frame['image_name'] for frame in frames))
+    )
     
     print(f"  Written: {cameras_path}")
     print(f"  Written: {images_path}")
     print(f"  Written: {points_path}")
+    print(f"  Written: {image_list_path}")
 
 
 def process_scan(
@@ -142,6 +334,7 @@ def process_scan(
     output_dir: Path,
     quality_threshold: float = 0.8,
     frame_skip: int = 1,
+    link_mode: str = 'symlink',
 ) -> dict:
     """
     Process an ARKit scan export and convert to COLMAP format.
@@ -151,6 +344,8 @@ def process_scan(
         output_dir: Path to output directory
         quality_threshold: Minimum motionQuality to include frame (0-1)
         frame_skip: Process every Nth frame (1 = all frames)
+        link_mode: How to populate output_dir/images: 'symlink' (default),
+            'copy', or 'none' (use the scan folder as COLMAP's image_path)
     
     Returns:
         dict with processing statistics
@@ -175,32 +370,40 @@ def process_scan(
     skipped_no_image = 0
     
     scan_dir = json_files[0].parent  # Directory containing the scan files
-    
-    for i, json_path in enumerate(tqdm(json_files, desc="Parsing metadata")):
-        # Skip frames based on frame_skip
-        if i % frame_skip != 0:
-            continue
-        
-        try:
-            frame = parse_arkit_json(json_path)
-        except (json.JSONDecodeError, KeyError) as e:
-            print(f"  Warning: Could not parse {json_path}: {e}")
-            continue
-        
-        # Filter by quality
-        if frame['motion_quality'] < quality_threshold:
+    image_index = build_image_index(scan_dir)
+    pad = detect_image_padding(image_index)
+    
+    # Frames are independent, so parse them across processes; only the
+    # subset surviving frame_skip is dispatched. Small scans stay in-process
+    # since pool start-up would cost more than the parsing itself.
+    selected_jsons = json_files[::frame_skip]
+    progress = partial(tqdm, total=len(selected_jsons), desc="Parsing metadata")
+    if len(selected_jsons) < PARALLEL_PARSE_MIN_FRAMES:
+        parse_one = partial(
+            _parse_one,
+            quality_threshold=quality_threshold,
+            image_index=image_index,
+            pad=pad,
+        )
+        results = [parse_one(json_path) for json_path in progress(selected_jsons)]
+    else:
+        workers = os.cpu_count() or 1
+        chunksize = max(1, len(selected_jsons) // (workers * 4))
+        parse_one = partial(_parse_one, quality_threshold=quality_threshold)
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_parse_worker,
+            initargs=(image_index, pad),
+        ) as executor:
+            results = list(progress(executor.map(parse_one, selected_jsons, chunksize=chunksize)))
+    
+    for frame, skip_reason in results:
+        if skip_reason == 'quality':
             skipped_quality += 1
-            continue
-        
-        # Find matching image
-        image_path = find_matching_image(json_path, scan_dir)
-        if image_path is None:
+        elif skip_reason == 'no_image':
             skipped_no_image += 1
-            continue
-        
-        frame['image_path'] = image_path
-        frame['image_name'] = image_path.name
-        frames.append(frame)
+        elif frame is not None:
+            frames.append(frame)
     
     print(f"\nFiltering results:")
     print(f"  Passed quality filter: {len(frames)}")
@@ -211,21 +414,33 @@ def process_scan(
         raise ValueError(f"Only {len(frames)} frames passed filtering. Need at least 10.")
     
     # Get image dimensions from first image
-    with Image.open(frames[0]['image_path']) as img:
-        image_width, image_height = img.size
+    image_width, image_height = jpeg_size(frames[0]['image_path'])
     print(f"  Image dimensions: {image_width}x{image_height}")
     
     # Create output directories
     output_dir.mkdir(parents=True, exist_ok=True)
-    images_dir = output_dir / 'images'
-    images_dir.mkdir(exist_ok=True)
     
-    # Copy images to output
-    print(f"\nCopying {len(frames)} images...")
-    for frame in tqdm(frames, desc="Copying images"):
-        dst = images_dir / frame['image_name']
-        if not dst.exists():
-            shutil.copy2(frame['image_path'], dst)
+    # Link or copy images to output (COLMAP only reads them)
+    if link_mode == 'none':
+        image_dir = scan_dir
+        print(f"\nUsing images in place: {image_dir}")
+    else:
+        image_dir = output_dir / 'images'
+        image_dir.mkdir(exist_ok=True)
+        # One directory listing instead of a stat per frame; keyed by name
+        # so frames sharing an image are only placed once
+        existing = set(os.listdir(image_dir))
+        pending = list({
+            frame['image_name']: frame
+            for frame in frames
+            if frame['image_name'] not in existing
+        }.values())
+        verb = 'Linking' if link_mode == 'symlink' else 'Copying'
+        print(f"\n{verb} {len(pending)} images ({len(existing)} already present)...")
+        # Filesystem-bound (sendfile releases the GIL), so use threads
+        link_one = partial(_link_image, images_dir=image_dir, link_mode=link_mode)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(tqdm(executor.map(link_one, pending), total=len(pending), desc=f"{verb} images"))
     
     # Write COLMAP model
     print("\nWriting COLMAP sparse model...")
@@ -239,11 +454,14 @@ def process_scan(
         'image_width': image_width,
         'image_height': image_height,
         'quality_threshold': quality_threshold,
+        'image_dir': image_dir,
     }
     
     print(f"\n✅ COLMAP model created at: {output_dir}")
     print(f"   Frames: {len(frames)}")
     print(f"   Next step: Run COLMAP feature extraction and triangulation")
+    if link_mode == 'none':
+        print(f"   Images left in place: ./run_colmap.sh {output_dir} {image_dir}")
     
     return stats
 
@@ -275,6 +493,13 @@ def main():
         default=1,
         help='Process every Nth frame (default: 1 = all frames)'
     )
+    parser.add_argument(
+        '--link-mode',
+        choices=['copy', 'symlink', 'none'],
+        default='symlink',
+        help='How to populate <output>/images: symlink to the scan images, '
+             'copy them, or none to use the scan folder directly (default: symlink)'
+    )
     
     args = parser.parse_args()
     
@@ -286,6 +511,7 @@ def main():
         args.output,
         quality_threshold=args.quality_threshold,
         frame_skip=args.frame_skip,
+        link_mode=args.link_mode,
     )
     
     return stats
@@ -1,9 +1,28 @@
 #!/usr/bin/env python3
 """Convert Brush PLY format to standard 3DGS PLY format."""
 
-import struct
+import mmap
 import sys
 
+import numpy as np
+
+try:
+    from numba import njit, prange
+except ImportError:  # Optional: fall back to the NumPy gather
+    njit = None
+
+# Vertices reordered per block; bounds peak memory to one block-sized
+# output buffer instead of a full vertex_count-sized reordered array
+CHUNK = 65536
+
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def _reorder(src, idx_arr, missing_mask, out):
+        """Fused gather: out[i, j] = src[i, idx_arr[j]], or 0 where missing."""
+        for i in prange(src.shape[0]):
+            for j in range(idx_arr.shape[0]):
+                out[i, j] = 0.0 if missing_mask[j] else src[i, idx_arr[j]]
+
 def convert_brush_to_standard(input_path, output_path):
     with open(input_path, 'rb') as f:
         # Read header
@@ -29,13 +48,15 @@ def convert_brush_to_standard(input_path, output_path):
         # Find property indices
         prop_indices = {name: i for i, name in enumerate(properties)}
         
-        # Read all vertex data
+        # Map the vertex data (paged in on demand, no copy into a bytes object)
         float_size = 4
         vertex_size = len(properties) * float_size
-        vertex_data = f.read()
+        header_end = f.tell()
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        payload_size = len(mm) - header_end
         
-        if len(vertex_data) != vertex_count * vertex_size:
-            print(f"Warning: Expected {vertex_count * vertex_size} bytes, got {len(vertex_data)}")
+        if payload_size != vertex_count * vertex_size:
+            print(f"Warning: Expected {vertex_count * vertex_size} bytes, got {payload_size}")
     
     # Define standard 3DGS property order
     standard_order = ['x', 'y', 'z', 'nx', 'ny', 'nz']
@@ -59,13 +80,17 @@ def convert_brush_to_standard(input_path, output_path):
         print(f"Missing properties: {missing[:10]}...")
     
     # Build reorder mapping
-    # For missing properties, we'll output 0
-    reorder = []
-    for prop in standard_order:
-        if prop in prop_indices:
-            reorder.append(prop_indices[prop])
-        else:
-            reorder.append(None)  # Will output 0
+    # For missing properties, we'll output 0 (index -1)
+    idx = np.array([prop_indices.get(prop, -1) for prop in standard_order], dtype=np.int64)
+    mask = idx >= 0
+    src_cols = idx[mask]
+    idx_arr = np.where(mask, idx, 0).astype(np.int32)
+    missing_mask = ~mask
+    
+    arr = np.frombuffer(mm, dtype='<f4', count=vertex_count * len(properties), offset=header_end)
+    arr = arr.reshape(vertex_count, len(properties))
+    # Missing columns are never written, so they stay 0 across chunks
+    out_chunk = np.zeros((min(CHUNK, vertex_count), len(standard_order)), dtype='<f4')
     
     # Write output
     with open(output_path, 'wb') as f:
@@ -77,18 +102,15 @@ def convert_brush_to_standard(input_path, output_path):
             f.write(f'property float {prop}\n'.encode())
         f.write(b'end_header\n')
         
-        # Write reordered vertex data
-        for i in range(vertex_count):
-            offset = i * vertex_size
-            for idx in reorder:
-                if idx is not None:
-                    val = struct.unpack_from('<f', vertex_data, offset + idx * float_size)[0]
-                else:
-                    val = 0.0
-                f.write(struct.pack('<f', val))
-            
-            if (i + 1) % 10000 == 0:
-                print(f"Processed {i + 1}/{vertex_count} vertices...")
+        # Write reordered vertex data, one block-sized gather at a time
+        for start in range(0, vertex_count, CHUNK):
+            stop = min(start + CHUNK, vertex_count)
+            block = out_chunk[:stop - start]
+            if njit is not None:
+                _reorder(arr[start:stop], idx_arr, missing_mask, block)
+            else:
+                block[:, mask] = arr[start:stop, src_cols]
+            block.tofile(f)
     
     print(f"Wrote {output_path}")
 
@@ -1,20 +1,72 @@
 #!/usr/bin/env python3
 """Convert PLY to .splat format for web viewers."""
 
-import struct
+import mmap
+
 import numpy as np
-from plyfile import PlyData
+from scipy.special import expit
+
+# float32 constants so arithmetic never promotes the float32 columns to float64
+SH_C0 = np.float32(0.28209479177387814)
+HALF = np.float32(0.5)
+C128 = np.float32(128.0)
+C255 = np.float32(255.0)
+
+def unit_to_uint8(buf):
+    """Map values in [0, 1] to 0-255 bytes, reusing buf as scratch space."""
+    buf *= C255
+    np.clip(buf, 0, C255, out=buf)
+    return buf.astype(np.uint8)
 
-def sigmoid(x):
-    return 1 / (1 + np.exp(-x))
+# PLY scalar types -> little-endian numpy dtypes
+PLY_DTYPES = {
+    'char': 'i1', 'int8': 'i1', 'uchar': 'u1', 'uint8': 'u1',
+    'short': '<i2', 'int16': '<i2', 'ushort': '<u2', 'uint16': '<u2',
+    'int': '<i4', 'int32': '<i4', 'uint': '<u4', 'uint32': '<u4',
+    'float': '<f4', 'float32': '<f4', 'double': '<f8', 'float64': '<f8',
+}
+
+def read_ply_vertices(input_path):
+    """Map the vertex element of a binary little-endian PLY as a structured array."""
+    with open(input_path, 'rb') as f:
+        element = None
+        vertex_count = 0
+        fields = []
+        
+        while True:
+            line = f.readline()
+            if not line:
+                raise ValueError(f"{input_path}: missing end_header")
+            tokens = line.decode('utf-8').split()
+            if not tokens:
+                continue
+            if tokens[0] == 'format' and tokens[1] != 'binary_little_endian':
+                raise ValueError(f"{input_path}: unsupported PLY format {tokens[1]}")
+            elif tokens[0] == 'element':
+                # Vertex data is read straight after the header, so it must come first
+                if element is None and tokens[1] != 'vertex':
+                    raise ValueError(f"{input_path}: vertex must be the first element")
+                element = tokens[1]
+                if element == 'vertex':
+                    vertex_count = int(tokens[2])
+            elif tokens[0] == 'property' and element == 'vertex':
+                if tokens[1] == 'list':
+                    raise ValueError(f"{input_path}: list properties are not supported")
+                fields.append((tokens[2], PLY_DTYPES[tokens[1]]))
+            elif tokens[0] == 'end_header':
+                break
+        
+        header_end = f.tell()
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    
+    return np.frombuffer(mm, dtype=np.dtype(fields), count=vertex_count, offset=header_end)
 
 def ply_to_splat(input_path, output_path):
     print(f"Loading {input_path}...")
-    plydata = PlyData.read(input_path)
-    vertex = plydata['vertex']
+    vertex = read_ply_vertices(input_path)
     
     print(f"Found {len(vertex)} vertices")
-    print(f"Properties: {[p.name for p in vertex.properties]}")
+    print(f"Properties: {list(vertex.dtype.names)}")
     
     # Extract properties
     x = vertex['x']
@@ -22,12 +74,12 @@ def ply_to_splat(input_path, output_path):
     z = vertex['z']
     
     # DC color coefficients (SH0)
-    f_dc_0 = vertex['f_dc_0']
-    f_dc_1 = vertex['f_dc_1']
-    f_dc_2 = vertex['f_dc_2']
+    f_dc_0 = vertex['f_dc_0'].astype(np.float32, copy=False)
+    f_dc_1 = vertex['f_dc_1'].astype(np.float32, copy=False)
+    f_dc_2 = vertex['f_dc_2'].astype(np.float32, copy=False)
     
     # Opacity (in log space, needs sigmoid)
-    opacity = vertex['opacity']
+    opacity = vertex['opacity'].astype(np.float32, copy=False)
     
     # Scale (in log space, needs exp)
     scale_0 = vertex['scale_0']
@@ -42,48 +94,60 @@ def ply_to_splat(input_path, output_path):
     
     # Convert to displayable values
     # Color: SH coefficient to RGB (simplified - just use DC term)
-    SH_C0 = 0.28209479177387814
-    r = np.clip((0.5 + SH_C0 * f_dc_0) * 255, 0, 255).astype(np.uint8)
-    g = np.clip((0.5 + SH_C0 * f_dc_1) * 255, 0, 255).astype(np.uint8)
-    b = np.clip((0.5 + SH_C0 * f_dc_2) * 255, 0, 255).astype(np.uint8)
+    # All intermediate math goes through one float32 scratch buffer
+    buf = np.empty(len(vertex), dtype=np.float32)
+    
+    np.multiply(f_dc_0, SH_C0, out=buf)
+    buf += HALF
+    r = unit_to_uint8(buf)
+    np.multiply(f_dc_1, SH_C0, out=buf)
+    buf += HALF
+    g = unit_to_uint8(buf)
+    np.multiply(f_dc_2, SH_C0, out=buf)
+    buf += HALF
+    b = unit_to_uint8(buf)
     
     # Alpha from opacity
-    a = np.clip(sigmoid(opacity) * 255, 0, 255).astype(np.uint8)
+    expit(opacity, out=buf)
+    a = unit_to_uint8(buf)
     
     # Scale: exp to get actual scale, then normalize
-    scale = np.exp(np.stack([scale_0, scale_1, scale_2], axis=-1))
+    scale = np.stack([scale_0, scale_1, scale_2], axis=-1).astype(np.float32, copy=False)
+    np.exp(scale, out=scale)
     
     # Normalize quaternion
-    quat = np.stack([rot_0, rot_1, rot_2, rot_3], axis=-1)
-    quat = quat / np.linalg.norm(quat, axis=-1, keepdims=True)
+    quat = np.stack([rot_0, rot_1, rot_2, rot_3], axis=-1).astype(np.float32, copy=False)
+    inv_norm = np.einsum('ij,ij->i', quat, quat)
+    np.sqrt(inv_norm, out=inv_norm)
+    np.reciprocal(inv_norm, out=inv_norm)
+    quat *= inv_norm[:, None]
     
     # Convert quaternion to packed format (128 = 0, 0-255 range)
-    quat_packed = np.clip((quat * 128 + 128), 0, 255).astype(np.uint8)
-    
-    # Scale to packed format
-    max_scale = np.max(scale)
-    scale_normalized = scale / max_scale
-    scale_packed = np.clip(scale_normalized * 255, 0, 255).astype(np.uint8)
+    quat *= C128
+    quat += C128
+    np.clip(quat, 0, C255, out=quat)
+    quat_packed = quat.astype(np.uint8)
     
     # Write .splat format
     # Format: for each splat: 3 floats (pos) + 3 floats (scale) + 4 bytes (rgba) + 4 bytes (quat)
     # = 12 + 12 + 4 + 4 = 32 bytes per splat
+    splat_dtype = np.dtype([
+        ('pos', '<f4', 3),
+        ('scale', '<f4', 3),
+        ('rgba', 'u1', 4),
+        ('quat', 'u1', 4),
+    ])
+    rec = np.empty(len(vertex), dtype=splat_dtype)
+    rec['pos'][:, 0] = x
+    rec['pos'][:, 1] = y
+    rec['pos'][:, 2] = z
+    rec['scale'] = scale
+    rec['rgba'] = np.stack([r, g, b, a], axis=-1)
+    rec['quat'] = quat_packed
     
     print(f"Writing {output_path}...")
     with open(output_path, 'wb') as f:
-        for i in range(len(vertex)):
-            # Position (3 floats)
-            f.write(struct.pack('<fff', x[i], y[i], z[i]))
-            # Scale (3 floats) 
-            f.write(struct.pack('<fff', scale[i, 0], scale[i, 1], scale[i, 2]))
-            # Color RGBA (4 bytes)
-            f.write(struct.pack('BBBB', r[i], g[i], b[i], a[i]))
-            # Rotation quaternion (4 bytes)
-            f.write(struct.pack('BBBB', quat_packed[i, 0], quat_packed[i, 1], 
-                                        quat_packed[i, 2], quat_packed[i, 3]))
-            
-            if (i + 1) % 20000 == 0:
-                print(f"  {i+1}/{len(vertex)}")
+        rec.tofile(f)
     
     print(f"Done! Wrote {len(vertex)} splats")
     
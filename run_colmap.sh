@@ -1,13 +1,17 @@
 #!/bin/bash
 # Run COLMAP pipeline on ARKit-converted data
-# Usage: ./run_colmap.sh <project_dir>
+# Usage: ./run_colmap.sh <project_dir> [image_dir]
+#   image_dir defaults to <project_dir>/images (pass the scan folder when
+#   arkit_to_colmap.py was run with --link-mode none; only the frames in
+#   <project_dir>/image_list.txt are then read from it)
 
 set -e
 
 PROJECT_DIR="${1:-.}"
 DATABASE_PATH="$PROJECT_DIR/database.db"
-IMAGE_PATH="$PROJECT_DIR/images"
+IMAGE_PATH="${2:-$PROJECT_DIR/images}"
 SPARSE_PATH="$PROJECT_DIR/sparse/0"
+IMAGE_LIST_PATH="$PROJECT_DIR/image_list.txt"
 
 echo "=== COLMAP Pipeline ==="
 echo "Project: $PROJECT_DIR"
@@ -25,6 +29,18 @@ if [ ! -d "$IMAGE_PATH" ]; then
     exit 1
 fi
 
+# A separate image dir (the raw scan folder) also holds frames that were
+# filtered out; restrict COLMAP to the kept ones so image IDs match images.txt
+IMAGE_LIST_ARGS=()
+if [ -n "$2" ]; then
+    if [ ! -f "$IMAGE_LIST_PATH" ]; then
+        echo "Error: Image list not found: $IMAGE_LIST_PATH"
+        echo "Run arkit_to_colmap.py first."
+        exit 1
+    fi
+    IMAGE_LIST_ARGS=(--image_list_path "$IMAGE_LIST_PATH")
+fi
+
 if [ ! -f "$SPARSE_PATH/cameras.txt" ]; then
     echo "Error: COLMAP model not found: $SPARSE_PATH/cameras.txt"
     echo "Run arkit_to_colmap.py first."
@@ -39,7 +55,8 @@ colmap feature_extractor \
     --database_path "$DATABASE_PATH" \
     --image_path "$IMAGE_PATH" \
     --ImageReader.camera_model PINHOLE \
-    --ImageReader.single_camera 1
+    --ImageReader.single_camera 1 \
+    "${IMAGE_LIST_ARGS[@]}"
 
 echo ""
 echo "=== Step 2: Sequential Matching ==="